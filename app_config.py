@@ -196,7 +196,6 @@ def configure_targets(deployment_target):
     global ELEX_INIT_FLAGS
     global ELEX_DISTRICTS_FLAGS
     global LOAD_RESULTS_INTERVAL
-    global ELEX_OUTPUT_FOLDER
 
 
     secrets = get_secrets()
@@ -223,7 +222,6 @@ def configure_targets(deployment_target):
         DEBUG = False
         ASSETS_MAX_AGE = 86400
         LOAD_RESULTS_INTERVAL = 60
-        ELEX_OUTPUT_FOLDER = '.data'
     elif deployment_target == 'staging':
         S3_BUCKET = STAGING_S3_BUCKET
         S3_BASE_URL = 'http://%s/%s' % (S3_BUCKET, PROJECT_SLUG)
@@ -235,7 +233,6 @@ def configure_targets(deployment_target):
         DEBUG = True
         ASSETS_MAX_AGE = 20
         LOAD_RESULTS_INTERVAL = 10
-        ELEX_OUTPUT_FOLDER = '.data'
     elif deployment_target == 'test':
         S3_BUCKET = STAGING_S3_BUCKET
         S3_BASE_URL = 'http://%s/%s' % (S3_BUCKET, PROJECT_SLUG)
@@ -252,7 +249,6 @@ def configure_targets(deployment_target):
         ELEX_DISTRICTS_FLAGS = '-d tests/data/test_districts.json -o csv'
         ELEX_INIT_FLAGS = '-d tests/data/test.json -o csv'
         LOAD_RESULTS_INTERVAL = 10
-        ELEX_OUTPUT_FOLDER = '.testdata'
         database['PGDATABASE'] = '{0}_test'.format(database['PGDATABASE'])
         database['PGUSER'] = '{0}_test'.format(database['PGUSER'])
     else:
@@ -266,7 +262,6 @@ def configure_targets(deployment_target):
         DEBUG = True
         ASSETS_MAX_AGE = 20
         LOAD_RESULTS_INTERVAL = 10
-        ELEX_OUTPUT_FOLDER = '.data'
 
     DEPLOYMENT_TARGET = deployment_target
 
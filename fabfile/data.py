@@ -8,19 +8,40 @@ import copytext
 import csv
 import logging
 import math
-import simplejson as json
-import yaml
+import os
+import psycopg2
 import requests
+import subprocess
+import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 from oauth import get_document
 from fabric.api import execute, hide, local, task, settings, shell_env
 from fabric.state import env
 from models import models
-from time import sleep
+from peewee import DatabaseError
+from requests.adapters import HTTPAdapter
+from time import time
+
+from . import fastio
+from . import utils
 
 CENSUS_REPORTER_URL = 'http://api.censusreporter.org/1.0/data/show/acs2014_5yr'
 FIPS_TEMPLATE = '05000US{0}'
 CENSUS_TABLES = ['B01003', 'B02001', 'B03002', 'B19013', 'B15001']
+CENSUS_CACHE_FOLDER = '.census_cache'
+CENSUS_CACHE_MAX_AGE = 30 * 86400
+CENSUS_BATCH_SIZE = 40
+CENSUS_MAX_WORKERS = 8
+# Census Reporter doesn't document a rate limit, so keep to the one request
+# every two seconds this task has always made. Workers still overlap the
+# latency of in-flight requests.
+CENSUS_REQUESTS_PER_SECOND = 0.5
+CENSUS_FAILURE_BACKOFF = 10
+ELEX_OUTPUT_HEAD_SIZE = 4096
+INSERT_BATCH_SIZE = 1000
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
@@ -32,8 +53,20 @@ def bootstrap_db():
     Build the database.
     """
     create_db()
-    create_tables()
-    load_results('init')
+
+    # Load results into an unlogged table so the COPY doesn't write WAL row by
+    # row. At the default wal_level, SET LOGGED then writes the whole table to
+    # WAL in one sequential pass. That trade-off is intended. Postgres won't let a logged
+    # table reference an unlogged one, so the tables that point at result are
+    # created once it is logged again.
+    _create_result_table(unlogged=True)
+
+    try:
+        load_results('init')
+    finally:
+        models.db.execute_sql('ALTER TABLE result SET LOGGED;')
+
+    _create_dependent_tables()
     create_calls()
     create_race_meta()
 
@@ -60,15 +93,23 @@ def create_db():
 
 @task
 def create_tables():
+    _create_result_table()
+    _create_dependent_tables()
+
+def _create_result_table(unlogged=False):
     models.Result.create_table()
-    models.Call.create_table()
-    models.RaceMeta.create_table()
 
-@task
-def delete_results(mode):
+    if unlogged:
+        models.db.execute_sql('ALTER TABLE result SET UNLOGGED;')
+
+def _create_dependent_tables():
     """
-    Delete results without droppping database.
+    Create the tables with foreign keys to result.
     """
+    models.Call.create_table()
+    models.RaceMeta.create_table()
+
+def _delete_results_sql(mode):
     if mode == 'fast':
         where_clause = "WHERE level = 'state' OR level = 'national' OR level = 'district'"
     elif mode == 'slow':
@@ -76,8 +117,17 @@ def delete_results(mode):
     else:
         where_clause = ''
 
-    with shell_env(**app_config.database), hide('output', 'running'):
-        local('psql {0} -c "set session_replication_role = replica; DELETE FROM result {1}; set session_replication_role = default;"'.format(app_config.database['PGDATABASE'], where_clause))
+    return 'DELETE FROM result {0};'.format(where_clause)
+
+@task
+def delete_results(mode):
+    """
+    Delete results without droppping database.
+    """
+    with models.db.atomic():
+        cursor = models.db.get_cursor()
+        cursor.execute('SET LOCAL session_replication_role = replica;')
+        cursor.execute(_delete_results_sql(mode))
 
 @task
 def load_results(mode):
@@ -93,94 +143,250 @@ def load_results(mode):
         flags = app_config.ELEX_INIT_FLAGS
 
     election_date = app_config.NEXT_ELECTION_DATE
-    with hide('output', 'running'):
-        local('mkdir -p {0}'.format(app_config.ELEX_OUTPUT_FOLDER))
 
-    cmd = 'elex results {0} {1} > {2}/first_query.csv'.format(election_date, flags, app_config.ELEX_OUTPUT_FOLDER)
-    districts_cmd = 'elex results {0} {1} | csvgrep -c level -m district > {2}/districts.csv'.format(election_date, app_config.ELEX_DISTRICTS_FLAGS, app_config.ELEX_OUTPUT_FOLDER)
+    cmd = 'elex results {0} {1}'.format(election_date, flags)
+    districts_cmd = 'elex results {0} {1} | csvgrep -c level -m district'.format(election_date, app_config.ELEX_DISTRICTS_FLAGS)
+
+    try:
+        _copy_results(mode, [cmd, districts_cmd])
+    except utils.ElexError as e:
+        print('ERROR GETTING RESULTS: {0}'.format(e.cmd))
+        print(e.stderr)
+        print(e.output)
+    except utils.ResultsLoadError as e:
+        print('ERROR LOADING RESULTS')
+        print(e)
+        print(e.output)
 
-    with shell_env(**app_config.database):
-        with settings(warn_only=True), hide('output', 'running'):
-            first_cmd_output = local(cmd, capture=True)
+    logger.info('results loaded')
 
-        if first_cmd_output.succeeded or first_cmd_output.return_code == 64:
-            with hide('output', 'running'):
-                district_cmd_output = local(districts_cmd, capture=True)
+def _start_elex(cmd):
+    """
+    Start an elex shell command with its CSV output on a pipe. stderr goes
+    to a temporary file so a chatty command can't block on a full pipe, and
+    the start of the output COPY reads is kept in another for debugging.
+    """
+    stderr = tempfile.TemporaryFile()
+    head = tempfile.TemporaryFile()
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True)
+    return cmd, process, stderr, head
 
-            if district_cmd_output.succeeded or district_cmd_output.return_code == 64:
-                delete_results(mode)
-                with hide('output', 'running'):
-                    local('csvstack {0}/first_query.csv {1}/districts.csv | psql {2} -c "COPY result FROM stdin DELIMITER \',\' CSV HEADER;"'.format(app_config.ELEX_OUTPUT_FOLDER, app_config.ELEX_OUTPUT_FOLDER, app_config.database['PGDATABASE']))
+def _tee_head(stream, head, limit=ELEX_OUTPUT_HEAD_SIZE):
+    """
+    Yield lines from stream, copying the first limit characters to head.
+    """
+    written = 0
 
-            else:
-                print("ERROR GETTING DISTRICT RESULTS")
-                print(district_cmd_output.stderr)
+    for line in stream:
+        if written < limit:
+            head.write(line[:limit - written].encode('utf-8'))
+            written += len(line)
 
-        else:
-            print("ERROR GETTING MAIN RESULTS")
-            print(first_cmd_output.stderr)
+        yield line
 
-    logger.info('results loaded')
+def _read_temp(f):
+    f.seek(0)
+    return f.read().decode('utf-8', 'replace')
+
+def _check_elex(commands):
+    for cmd, process, stderr, head in commands:
+        # Drain whatever COPY didn't read so the command can't block on a full
+        # pipe while we wait for it to exit.
+        process.stdout.read()
+
+        if process.wait() not in (0, 64):
+            raise utils.ElexError(cmd, _read_temp(stderr), _read_temp(head))
+
+def _copy_results(mode, commands):
+    """
+    Replace the results for a load mode with the stacked output of elex
+    commands in a single transaction, streaming straight into COPY. If any
+    command fails the transaction is rolled back and ElexError is raised;
+    any other database error during the load raises ResultsLoadError.
+    """
+    processes = [_start_elex(cmd) for cmd in commands]
+
+    try:
+        try:
+            with models.db.atomic():
+                cursor = models.db.get_cursor()
+                cursor.execute('SET LOCAL session_replication_role = replica;')
+                cursor.execute(_delete_results_sql(mode))
+                cursor.copy_expert('COPY result FROM STDIN WITH (FORMAT csv, HEADER true);', utils.CSVStack([_tee_head(process.stdout, head) for _, process, _, head in processes]))
+                _check_elex(processes)
+        except (psycopg2.Error, DatabaseError) as e:
+            # Bad elex output usually surfaces as a COPY error, so blame the
+            # command if one failed before reporting the database error.
+            _check_elex(processes)
+            output = '\n'.join('{0}:\n{1}'.format(cmd, _read_temp(head)) for cmd, _, _, head in processes)
+            raise utils.ResultsLoadError(str(e), output) from e
+    finally:
+        for _, process, stderr, head in processes:
+            if process.poll() is None:
+                process.kill()
+
+            process.wait()
+            process.stdout.close()
+            stderr.close()
+            head.close()
 
 @task
 def create_calls():
     """
     Create database of race calls for all races in results data.
     """
-    models.Call.delete().execute()
-
-    results = models.Result.select().where(
+    results = models.Result.select(models.Result.id).where(
         (models.Result.level == 'state') | (models.Result.level == 'national') | (models.Result.level == 'district')
-    )
+    ).tuples()
 
-    for result in results:
-        models.Call.create(call_id=result.id)
+    rows = [{'call_id': result_id} for result_id, in results]
+
+    with models.db.atomic():
+        models.Call.delete().execute()
+
+        for i in range(0, len(rows), INSERT_BATCH_SIZE):
+            models.Call.insert_many(rows[i:i + INSERT_BATCH_SIZE]).execute()
 
 @task
 def create_race_meta():
-    models.RaceMeta.delete().execute()
-
     calendar = copytext.Copy(app_config.CALENDAR_PATH)
     calendar_sheet = calendar['poll_times']
     senate_sheet = calendar['senate_seats']
     house_sheet = calendar['house_seats']
 
-    results = models.Result.select()
+    calendar_by_state = {str(row['key']): row for row in calendar_sheet}
+    house_by_seat = {str(row['seat']): row for row in house_sheet}
+    senate_by_state = {str(row['state']): row for row in senate_sheet}
+
+    # every row carries every column so the batches share one column list
+    batch = []
+    results = models.Result.select(
+        models.Result.id,
+        models.Result.level,
+        models.Result.officename,
+        models.Result.seatnum,
+        models.Result.statepostal
+    ).where(
+        (models.Result.level == 'state') | (models.Result.level == 'national') | (models.Result.level == 'district')
+    ).dicts()
     for result in results:
         meta_obj = {
-            'result_id': result.id
+            'result_id': result['id'],
+            'poll_closing': None,
+            'first_results': None,
+            'full_poll_closing': None,
+            'current_party': None,
+            'expected': None
         }
 
-        if result.level == 'county' or result.level == 'township':
-            continue
+        if result['level'] == 'state' or result['level'] == 'district':
+            calendar_row = calendar_by_state.get(result['statepostal'])
 
-        if result.level == 'state' or result.level == 'district':
-            calendar_row = list(filter(lambda x: x['key'] == result.statepostal, calendar_sheet))[0]
+            if calendar_row:
+                meta_obj['poll_closing'] = calendar_row['time_est']
+                meta_obj['first_results'] = calendar_row['first_results_est']
+                meta_obj['full_poll_closing'] = calendar_row['time_all_est']
+            else:
+                logger.warning('no poll times for {0}'.format(result['statepostal']))
 
-            meta_obj['poll_closing'] = calendar_row['time_est']
-            meta_obj['first_results'] = calendar_row['first_results_est']
-            meta_obj['full_poll_closing'] = calendar_row['time_all_est']
+        if result['level'] == 'state' and result['officename'] == 'U.S. House':
+            seat = '{0}-{1}'.format(result['statepostal'], result['seatnum'])
+            house_row = house_by_seat.get(seat)
 
-        if result.level == 'state' and result.officename == 'U.S. House':
-            seat = '{0}-{1}'.format(result.statepostal, result.seatnum)
-            house_row = list(filter(lambda x: x['seat'] == seat, house_sheet))[0]
-            meta_obj['current_party'] = house_row['party']
+            if house_row:
+                meta_obj['current_party'] = house_row['party']
 
-            if 'competitive' in house_row['expected']:
-                meta_obj['expected'] = 'competitive'
+                if 'competitive' in house_row['expected']:
+                    meta_obj['expected'] = 'competitive'
+                else:
+                    meta_obj['expected'] = house_row['expected']
             else:
-                meta_obj['expected'] = house_row['expected']
+                logger.warning('no house seat data for {0}'.format(seat))
 
-        if result.level == 'state' and result.officename == 'U.S. Senate':
-            senate_row = list(filter(lambda x: x['state'] == result.statepostal, senate_sheet))[0]
-            meta_obj['current_party'] = senate_row['party']
+        if result['level'] == 'state' and result['officename'] == 'U.S. Senate':
+            senate_row = senate_by_state.get(result['statepostal'])
 
-            if 'competitive' in senate_row['expected']:
-                meta_obj['expected'] = 'competitive'
+            if senate_row:
+                meta_obj['current_party'] = senate_row['party']
+
+                if 'competitive' in senate_row['expected']:
+                    meta_obj['expected'] = 'competitive'
+                else:
+                    meta_obj['expected'] = senate_row['expected']
             else:
-                meta_obj['expected'] = senate_row['expected']
+                logger.warning('no senate seat data for {0}'.format(result['statepostal']))
+
+        batch.append(meta_obj)
+
+    with models.db.atomic():
+        _create_race_meta_unique_index()
+        models.RaceMeta.delete().where(
+            ~(models.RaceMeta.result_id << models.Result.select(models.Result.id))
+        ).execute()
+
+        for i in range(0, len(batch), INSERT_BATCH_SIZE):
+            _upsert_race_meta(batch[i:i + INSERT_BATCH_SIZE])
+
+def _create_race_meta_unique_index():
+    """
+    The upsert needs a unique index on result_id. Tables created before the
+    field was marked unique have a plain foreign key index under the same
+    name peewee gives the unique one, so check indisunique rather than the
+    name and replace a non-unique index.
+    """
+    table = models.RaceMeta._meta.db_table
+    column = models.RaceMeta.result_id.db_column
+
+    cursor = models.db.execute_sql("""
+        SELECT i.relname, x.indisunique AND x.indpred IS NULL
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0]
+        WHERE x.indrelid = %s::regclass
+        AND x.indnatts = 1
+        AND a.attname = %s;
+    """, [table, column])
+    indexes = cursor.fetchall()
+
+    if any(unique for _, unique in indexes):
+        return
+
+    for name, _ in indexes:
+        models.db.execute_sql('DROP INDEX "{0}";'.format(name))
+
+    models.db.execute_sql('CREATE UNIQUE INDEX "{0}_{1}" ON "{0}" ("{1}");'.format(table, column))
+
+def _upsert_race_meta(rows):
+    """
+    Insert race meta rows, updating existing rows for the same result only
+    when a value has changed. Peewee 2.x can't build ON CONFLICT for
+    Postgres, so the statement is assembled here.
+    """
+    key = models.RaceMeta.result_id
+    fields = [
+        key,
+        models.RaceMeta.poll_closing,
+        models.RaceMeta.first_results,
+        models.RaceMeta.full_poll_closing,
+        models.RaceMeta.current_party,
+        models.RaceMeta.expected
+    ]
+    table = '"{0}"'.format(models.RaceMeta._meta.db_table)
+    columns = ['"{0}"'.format(field.db_column) for field in fields]
+    updates = [column for field, column in zip(fields, columns) if field is not key]
+
+    sql = 'INSERT INTO {0} ({1}) VALUES {2} ON CONFLICT ("{3}") DO UPDATE SET {4} WHERE ({5}) IS DISTINCT FROM ({6});'.format(
+        table,
+        ', '.join(columns),
+        ', '.join(['({0})'.format(', '.join(['%s'] * len(fields)))] * len(rows)),
+        key.db_column,
+        ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in updates),
+        ', '.join('{0}.{1}'.format(table, column) for column in updates),
+        ', '.join('EXCLUDED.{0}'.format(column) for column in updates)
+    )
+    params = [field.db_value(row[field.name]) for row in rows for field in fields]
 
-        models.RaceMeta.create(**meta_obj)
+    models.db.execute_sql(sql, params)
 
 @task
 def copy_data_for_graphics():
@@ -191,7 +397,8 @@ def copy_data_for_graphics():
     else:
         graphics_folder = '../elections16graphics/www/data/'
 
-    local('cp -r {0}/* {1}'.format(app_config.DATA_OUTPUT_FOLDER, graphics_folder))
+    # render_all rewrites every file, so compare contents rather than mtimes
+    local('rsync -a --checksum {0}/ {1}'.format(app_config.DATA_OUTPUT_FOLDER, graphics_folder))
 
 @task
 def build_current_congress():
@@ -204,75 +411,172 @@ def build_current_congress():
     house_fieldnames = ['first', 'last', 'party', 'state', 'seat']
     senate_fieldnames = ['first', 'last', 'party', 'state']
 
-    with open('data/house-seats.csv', 'w') as h, open('data/senate-seats.csv', 'w') as s:
+    with open('etc/legislators-current.yaml') as f:
+        data = fastio.yaml_load(f)
+
+    house_rows = []
+    senate_rows = []
+
+    for legislator in data:
+        current_term = legislator['terms'][-1]
+
+        if current_term['end'][:4] == '2017':
+            obj = {
+                'first': legislator['name']['first'],
+                'last': legislator['name']['last'],
+                'state': current_term['state'],
+                'party': party_dict[current_term['party']]
+            }
+
+            if current_term.get('district'):
+                obj['seat'] = '{0}-{1}'.format(current_term['state'], current_term['district'])
+
+            if current_term['type'] == 'sen':
+                senate_rows.append(obj)
+            elif current_term['type'] == 'rep':
+                house_rows.append(obj)
+
+    with open('data/house-seats.csv', 'w', buffering=1 << 20) as h, open('data/senate-seats.csv', 'w', buffering=1 << 20) as s:
         house_writer = csv.DictWriter(h, fieldnames=house_fieldnames)
         house_writer.writeheader()
+        house_writer.writerows(house_rows)
 
         senate_writer = csv.DictWriter(s, fieldnames=senate_fieldnames)
         senate_writer.writeheader()
+        senate_writer.writerows(senate_rows)
+
+def _get_census_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=CENSUS_MAX_WORKERS, pool_maxsize=CENSUS_MAX_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _census_geo_id(fipscode):
+    if fipscode == '02000':
+        return '04000US02'
+    elif fipscode == '46102':
+        return FIPS_TEMPLATE.format('46113')
+    else:
+        return FIPS_TEMPLATE.format(fipscode)
 
-        with open('etc/legislators-current.yaml') as f:
-            data = yaml.load(f)
+def _census_cache_path(geo_id):
+    return '{0}/{1}_{2}.json'.format(CENSUS_CACHE_FOLDER, geo_id, '-'.join(CENSUS_TABLES))
 
-        for legislator in data:
-            current_term = legislator['terms'][-1]
+def _read_census_cache(geo_id):
+    path = _census_cache_path(geo_id)
 
-            if current_term['end'][:4] == '2017':
-                obj = {
-                    'first': legislator['name']['first'],
-                    'last': legislator['name']['last'],
-                    'state': current_term['state'],
-                    'party': party_dict[current_term['party']]
-                }
+    try:
+        if time() - os.path.getmtime(path) > CENSUS_CACHE_MAX_AGE:
+            return None
 
-                if current_term.get('district'):
-                    obj['seat'] = '{0}-{1}'.format(current_term['state'], current_term['district'])
+        with open(path, 'rb') as f:
+            return fastio.json_loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
 
-                if current_term['type'] == 'sen':
-                    senate_writer.writerow(obj)
-                elif current_term['type'] == 'rep':
-                    house_writer.writerow(obj)
+def _write_census_cache(geo_id, census):
+    os.makedirs(CENSUS_CACHE_FOLDER, exist_ok=True)
+
+    with open(_census_cache_path(geo_id), 'wb') as f:
+        f.write(fastio.json_dumps(census))
+
+def _split_census_response(census, geo_id):
+    """
+    Pull a single geography out of a multi-geography census reporter
+    response, keeping the shape of a single-geography response.
+    """
+    if geo_id not in census.get('data', {}):
+        return None
+
+    return {
+        'release': census.get('release'),
+        'tables': census.get('tables'),
+        'data': {geo_id: census['data'][geo_id]},
+        'geography': {geo_id: census.get('geography', {}).get(geo_id)}
+    }
+
+def _fetch_census(session, limiter, fipscodes):
+    geo_ids = [_census_geo_id(fipscode) for fipscode in fipscodes]
+    params = {
+        'geo_ids': ','.join(geo_ids),
+        'table_ids': ','.join(CENSUS_TABLES)
+    }
+
+    limiter.acquire()
+    response = session.get(CENSUS_REPORTER_URL, params=params, timeout=30)
+
+    if response.status_code != 200:
+        print('fipscodes failed:', ','.join(fipscodes), response.status_code)
+        limiter.pause(CENSUS_FAILURE_BACKOFF)
+
+        if len(fipscodes) == 1:
+            return {}
+
+        # A single bad geo id fails the whole request, so retry each half
+        # until the failure is narrowed down to the county that caused it.
+        middle = len(fipscodes) // 2
+        output = _fetch_census(session, limiter, fipscodes[:middle])
+        output.update(_fetch_census(session, limiter, fipscodes[middle:]))
+        return output
+
+    data = response.json()
+
+    output = {}
+    for fipscode, geo_id in zip(fipscodes, geo_ids):
+        census = _split_census_response(data, geo_id)
+
+        if census:
+            print('fipscode succeeded', fipscode)
+            _write_census_cache(geo_id, census)
+            output[fipscode] = census
+        else:
+            print('fipscode missing from response:', fipscode)
+
+    return output
+
+def _select_fipscodes_by_state():
+    """
+    Fetch every distinct (statepostal, fipscode) pair in one query and group
+    the fipscodes by state. States with no fipscodes get an empty list.
+    """
+    results = models.Result.select(models.Result.statepostal, models.Result.fipscode).distinct().order_by(models.Result.statepostal, models.Result.fipscode).tuples()
+
+    for state, rows in groupby(results, key=itemgetter(0)):
+        yield state, [fipscode for _, fipscode in rows if fipscode]
 
 @task
 def get_census_data(start_state='AA'):
-    state_results = models.Result.select(models.Result.statepostal).distinct().order_by(models.Result.statepostal)
-
-    for state_result in state_results:
-        state = state_result.statepostal
-
-        sorts = sorted([start_state, state])
-        
-        if sorts[0] == state:
-            print('skipping', state)
-            continue
-
-        print('getting', state)
-        output = {}
-        fips_results = models.Result.select(models.Result.fipscode).distinct().where(models.Result.statepostal == state).order_by(models.Result.fipscode)
-        for result in fips_results:
-            if result.fipscode:
-                if result.fipscode == '02000':
-                    geo_id = '04000US02'
-                elif result.fipscode == '46102':
-                    geo_id = FIPS_TEMPLATE.format('46113')
-                else:
-                    geo_id = FIPS_TEMPLATE.format(result.fipscode)
-                params = {
-                    'geo_ids': geo_id,
-                    'table_ids': ','.join(CENSUS_TABLES)
-                }
-                response = requests.get(CENSUS_REPORTER_URL, params=params)
-                if response.status_code == 200:
-                    print('fipscode succeeded', result.fipscode)
-                    output[result.fipscode] = response.json()
-                    sleep(2)
+    session = _get_census_session()
+    limiter = utils.RateLimiter(CENSUS_REQUESTS_PER_SECOND)
+
+    with ThreadPoolExecutor(max_workers=CENSUS_MAX_WORKERS) as executor:
+        for state, fipscodes in _select_fipscodes_by_state():
+            sorts = sorted([start_state, state])
+
+            if sorts[0] == state:
+                print('skipping', state)
+                continue
+
+            print('getting', state)
+            output = {}
+            uncached = []
+            for fipscode in fipscodes:
+                census = _read_census_cache(_census_geo_id(fipscode))
+
+                if census:
+                    print('fipscode cached', fipscode)
+                    output[fipscode] = census
                 else:
-                    print('fipscode failed:', result.fipscode, response.status_code)
-                    sleep(10)
-                    continue
+                    uncached.append(fipscode)
+
+            batches = [uncached[i:i + CENSUS_BATCH_SIZE] for i in range(0, len(uncached), CENSUS_BATCH_SIZE)]
+            jobs = executor.map(lambda batch: _fetch_census(session, limiter, batch), batches)
+            for census in jobs:
+                output.update(census)
 
-        with open('data/census/{0}.json'.format(state), 'w') as f:
-            json.dump(output, f)
+            with open('data/census/{0}.json'.format(state), 'wb') as f:
+                f.write(fastio.json_dumps(output))
 
 
 @task
@@ -388,70 +692,94 @@ def calculate_percent_bachelors(education, education_error):
 
     return percent_bachelors, error
 
-def extract_2012_data(fipscode, filename):
+def load_2012_data(filename):
+    """
+    Index 2012 presidential vote percentages by (fipscode, last name).
+    """
+    twenty_twelve = {}
+
     with open(filename) as f:
-        reader = csv.DictReader(f)
-        obama_row = [row for row in reader if row['fipscode'] == fipscode and row['last'] == 'Obama' and row['level'] != 'township']
-        f.seek(0)
-        romney_row = [row for row in reader if row['fipscode'] == fipscode and row['last'] == 'Romney' and row['level'] != 'township']
+        reader = csv.reader(f)
+        header = next(reader)
+        fipscode = header.index('fipscode')
+        last = header.index('last')
+        level = header.index('level')
+        votepct = header.index('votepct')
 
+        for row in reader:
+            if row[level] != 'township':
+                twenty_twelve.setdefault((row[fipscode], row[last]), row[votepct])
 
-        if obama_row and romney_row:
-            obama_result = obama_row[0]['votepct']
-            romney_result = romney_row[0]['votepct']
+    return twenty_twelve
 
-            difference = (float(obama_result) * 100) - (float(romney_result) * 100)
+def extract_2012_data(fipscode, twenty_twelve):
+    obama_result = twenty_twelve.get((fipscode, 'Obama'))
+    romney_result = twenty_twelve.get((fipscode, 'Romney'))
 
-            if difference > 0:
-                margin = 'D +{0}'.format(round(difference))
-            else:
-                margin = 'R +{0}'.format(round(abs(difference)))
+    if obama_result and romney_result:
+        difference = (float(obama_result) * 100) - (float(romney_result) * 100)
 
-            return margin
-        
+        if difference > 0:
+            margin = 'D +{0}'.format(round(difference))
         else:
-            return None
+            margin = 'R +{0}'.format(round(abs(difference)))
 
-def extract_unemployment_data(fipscode, filename):
-    with open(filename) as f:
-        reader = csv.DictReader(f)
-        state_fips = fipscode[:2]
-        county_fips = fipscode[-3:]
-        unemployment_row = [row for row in reader if row['State FIPS Code'] == state_fips and row['County FIPS Code'] == county_fips]
-        if unemployment_row:
-            unemployment_rate = unemployment_row[0]['Unemployment Rate (%)']
-            return float(unemployment_rate.strip())
-        else:
-            return None
+        return margin
 
-@task
-def save_old_data():
-    state_results = models.Result.select(models.Result.statepostal).distinct().order_by(models.Result.statepostal)
+    else:
+        return None
 
-    for state_result in state_results:
-        state = state_result.statepostal
-        print('getting', state)
-        output = {}
+def load_unemployment_data(filename):
+    """
+    Index county unemployment rates by (state fips, county fips).
+    """
+    unemployment = {}
 
-        with open('data/census/{0}.json'.format(state)) as c:
-            census_json = json.load(c)
+    with open(filename) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        state_fips = header.index('State FIPS Code')
+        county_fips = header.index('County FIPS Code')
+        rate = header.index('Unemployment Rate (%)')
+
+        for row in reader:
+            unemployment.setdefault((row[state_fips], row[county_fips]), row[rate])
+
+    return unemployment
+
+def extract_unemployment_data(fipscode, unemployment):
+    state_fips = fipscode[:2]
+    county_fips = fipscode[-3:]
+    unemployment_rate = unemployment.get((state_fips, county_fips))
+    if unemployment_rate:
+        return float(unemployment_rate.strip())
+    else:
+        return None
 
-        fips_results = models.Result.select(models.Result.fipscode).distinct().where(models.Result.statepostal == state, models.Result.fipscode != None).order_by(models.Result.fipscode)
-        for result in fips_results:
-            print('extracting', result.fipscode)
+@task
+def save_old_data():
+    unemployment_data = load_unemployment_data('data/unemployment.csv')
+    twenty_twelve = load_2012_data('data/twentyTwelve.csv')
+
+    for state, fipscodes in _select_fipscodes_by_state():
+        rows = {}
+        for fipscode in fipscodes:
+            rows[fipscode] = {
+                'unemployment': extract_unemployment_data(fipscode, unemployment_data),
+                'past_margin': extract_2012_data(fipscode, twenty_twelve)
+            }
 
-            unemployment = extract_unemployment_data(result.fipscode, 'data/unemployment.csv')
-            past_margin = extract_2012_data(result.fipscode, 'data/twentyTwelve.csv')
-            census = extract_census_data(result.fipscode, census_json)
+        _save_state_old_data(state, rows)
 
-            this_row = {
-                'unemployment': unemployment,
-                'past_margin': past_margin,
-                'census': census
-            }
+def _save_state_old_data(state, rows):
+    print('getting', state)
 
-            output[result.fipscode] = this_row
+    with open('data/census/{0}.json'.format(state), 'rb') as c:
+        census_json = fastio.json_loads(c.read())
 
+    for fipscode, this_row in rows.items():
+        print('extracting', fipscode)
+        this_row['census'] = extract_census_data(fipscode, census_json)
 
-        with open('data/extra_data/{0}-extra.json'.format(state.lower()), 'w') as datafile:
-            json.dump(output, datafile)
+    with open('data/extra_data/{0}-extra.json'.format(state.lower()), 'wb') as datafile:
+        datafile.write(fastio.json_dumps(rows))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""
+Fastest available JSON and YAML (de)serializers, picked once at import.
+"""
+import yaml
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import simplejson as json
+
+try:
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
+
+def json_dumps(obj):
+    """
+    Serialize obj to JSON bytes.
+    """
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        return json.dumps(obj).encode('utf-8')
+
+def json_loads(data):
+    """
+    Parse JSON from bytes or str.
+    """
+    if orjson:
+        return orjson.loads(data)
+    else:
+        return json.loads(data)
+
+def yaml_load(stream):
+    return yaml.load(stream, Loader=YAMLLoader)
@@ -6,7 +6,8 @@ from datetime import date, datetime
 import logging
 from pytz import timezone
 import simplejson as json
-from time import time
+import threading
+from time import monotonic, sleep, time
 
 from boto.s3.connection import OrdinaryCallingFormat
 from fabric.api import local, task
@@ -128,4 +129,94 @@ def ap_time_period_filter(value):
 def _set_timezone(value):
     datetime_obj_utc = value.replace(tzinfo=timezone('GMT'))
     datetime_obj_est = datetime_obj_utc.astimezone(timezone('US/Eastern'))
-    return datetime_obj_est
\ No newline at end of file
+    return datetime_obj_est
+
+class ElexError(Exception):
+    """
+    An elex command exited with an error while its output was being loaded.
+    output holds the start of what COPY read from it.
+    """
+    def __init__(self, cmd, stderr, output=''):
+        super(ElexError, self).__init__(cmd)
+        self.cmd = cmd
+        self.stderr = stderr
+        self.output = output
+
+class ResultsLoadError(Exception):
+    """
+    The database rejected a results load, e.g. malformed elex output or a
+    dropped connection during COPY. output holds the start of what COPY
+    read from each elex command.
+    """
+    def __init__(self, message, output=''):
+        super(ResultsLoadError, self).__init__(message)
+        self.output = output
+
+class CSVStack(object):
+    """
+    Read-only file-like object that concatenates CSV streams, dropping the
+    header row of every stream after the first, for feeding to COPY.
+    """
+    def __init__(self, streams):
+        self.streams = streams
+        self._lines = self._iter_lines()
+
+    def _iter_lines(self):
+        for i, stream in enumerate(self.streams):
+            if i > 0:
+                next(stream, None)
+
+            yield from stream
+
+    def read(self, size=-1):
+        chunk = []
+        length = 0
+
+        for line in self._lines:
+            chunk.append(line)
+            length += len(line)
+
+            if size > 0 and length >= size:
+                break
+
+        return ''.join(chunk)
+
+class RateLimiter(object):
+    """
+    Token bucket shared between worker threads. Callers block in acquire()
+    until a token is available. pause() stops every caller for a while,
+    e.g. to back off after an API error.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+
+                    wait = (1 - self.tokens) / self.rate
+
+            sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            now = monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
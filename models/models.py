@@ -113,7 +113,7 @@ class Call(BaseModel):
 
 
 class RaceMeta(BaseModel):
-    result_id = ForeignKeyField(Result, related_name='meta')
+    result_id = ForeignKeyField(Result, related_name='meta', unique=True)
     poll_closing = CharField(null=True)
     full_poll_closing = CharField(null=True)
     first_results = CharField(null=True)
@@ -3,10 +3,14 @@
 import app_config
 import app_utils
 import calendar
+import io
+import psycopg2
+import tempfile
 import time
 import unittest
 
-from fabfile import data, render
+from unittest import mock
+from fabfile import data, render, utils
 from models import models
 from peewee import *
 
@@ -108,5 +112,266 @@ class ResultsRenderingTestCase(unittest.TestCase):
 
         self.assertEqual(len(serialized_results.keys()), 67)
 
+class CSVStackTestCase(unittest.TestCase):
+    """
+    Test concatenating elex CSV output for COPY
+    """
+
+    def setUp(self):
+        self.streams = [
+            io.StringIO('id,level\n1,state\n2,state\n'),
+            io.StringIO('id,level\n3,district\n')
+        ]
+
+    def test_drops_later_headers(self):
+        stack = utils.CSVStack(self.streams)
+        self.assertEqual(stack.read(), 'id,level\n1,state\n2,state\n3,district\n')
+
+    def test_chunked_read(self):
+        stack = utils.CSVStack(self.streams)
+        chunks = []
+
+        chunk = stack.read(10)
+        while chunk:
+            chunks.append(chunk)
+            chunk = stack.read(10)
+
+        self.assertEqual(chunks, ['id,level\n1,state\n', '2,state\n3,district\n'])
+
+    def test_empty_streams(self):
+        stack = utils.CSVStack([io.StringIO(''), io.StringIO('')])
+        self.assertEqual(stack.read(), '')
+
+class RateLimiterTestCase(unittest.TestCase):
+    """
+    Test the shared census request rate limiter
+    """
+
+    def test_acquire_waits_for_token(self):
+        limiter = utils.RateLimiter(20)
+        limiter.acquire()
+
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_pause_blocks_acquire(self):
+        limiter = utils.RateLimiter(1000)
+        limiter.pause(0.2)
+
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+class OldDataExtractionTestCase(unittest.TestCase):
+    """
+    Test extracting 2012 results and unemployment data by fipscode
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.twenty_twelve = data.load_2012_data('data/twentyTwelve.csv')
+        cls.unemployment = data.load_unemployment_data('data/unemployment.csv')
+
+    def test_2012_margin(self):
+        self.assertEqual(data.extract_2012_data('01001', self.twenty_twelve), 'R +46')
+
+    def test_2012_missing_fipscode(self):
+        self.assertIsNone(data.extract_2012_data('99999', self.twenty_twelve))
+
+    def test_2012_ignores_townships(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('fipscode,last,level,votepct\n')
+            f.write('09001,Obama,township,0.9\n')
+            f.write('09001,Obama,county,0.55\n')
+            f.write('09001,Romney,county,0.44\n')
+            f.flush()
+
+            twenty_twelve = data.load_2012_data(f.name)
+
+        self.assertEqual(twenty_twelve[('09001', 'Obama')], '0.55')
+        self.assertEqual(data.extract_2012_data('09001', twenty_twelve), 'D +11')
+
+    def test_unemployment_rate(self):
+        self.assertEqual(data.extract_unemployment_data('01001', self.unemployment), 5.2)
+
+    def test_unemployment_missing_fipscode(self):
+        self.assertIsNone(data.extract_unemployment_data('99999', self.unemployment))
+
+class CensusResponseTestCase(unittest.TestCase):
+    """
+    Test splitting batched census reporter responses
+    """
+
+    def setUp(self):
+        self.response = {
+            'release': {'id': 'acs2014_5yr'},
+            'tables': {'B01003': {}},
+            'data': {
+                '05000US01001': {'B01003': {'estimate': {'B01003001': 1}}},
+                '05000US01003': {'B01003': {'estimate': {'B01003001': 2}}}
+            },
+            'geography': {
+                '05000US01001': {'name': 'Autauga County, AL'},
+                '05000US01003': {'name': 'Baldwin County, AL'}
+            }
+        }
+
+    def test_split_response(self):
+        census = data._split_census_response(self.response, '05000US01003')
+
+        self.assertEqual(census['release'], {'id': 'acs2014_5yr'})
+        self.assertEqual(census['tables'], {'B01003': {}})
+        self.assertEqual(list(census['data'].keys()), ['05000US01003'])
+        self.assertEqual(census['geography'], {'05000US01003': {'name': 'Baldwin County, AL'}})
+
+    def test_split_response_missing_geo_id(self):
+        self.assertIsNone(data._split_census_response(self.response, '05000US99999'))
+
+    def test_failed_batch_is_split(self):
+        class FakeResponse(object):
+            def __init__(self, status_code, body=None):
+                self.status_code = status_code
+                self.body = body
+
+            def json(self):
+                return self.body
+
+        class FakeSession(object):
+            def __init__(self, response):
+                self.response = response
+                self.requests = []
+
+            def get(self, url, params, timeout):
+                geo_ids = params['geo_ids'].split(',')
+                self.requests.append(geo_ids)
+
+                if '05000US99999' in geo_ids:
+                    return FakeResponse(400)
+
+                return FakeResponse(200, {
+                    'release': self.response['release'],
+                    'tables': self.response['tables'],
+                    'data': {geo_id: self.response['data'][geo_id] for geo_id in geo_ids},
+                    'geography': {geo_id: self.response['geography'][geo_id] for geo_id in geo_ids}
+                })
+
+        session = FakeSession(self.response)
+        limiter = utils.RateLimiter(1000)
+
+        with mock.patch.object(data, '_write_census_cache'), mock.patch.object(data, 'CENSUS_FAILURE_BACKOFF', 0):
+            output = data._fetch_census(session, limiter, ['01001', '99999', '01003'])
+
+        self.assertEqual(sorted(output.keys()), ['01001', '01003'])
+        self.assertEqual(session.requests[0], ['05000US01001', '05000US99999', '05000US01003'])
+
+class RaceMetaUpsertTestCase(unittest.TestCase):
+    """
+    Test the race meta upsert statement and its unique index
+    """
+
+    def test_upsert_statement(self):
+        key = models.RaceMeta.result_id.db_column
+        rows = [
+            {'result_id': 'a', 'poll_closing': '7:00 PM', 'first_results': '7:30 PM', 'full_poll_closing': '8:00 PM', 'current_party': 'GOP', 'expected': 'competitive'},
+            {'result_id': 'b', 'poll_closing': None, 'first_results': None, 'full_poll_closing': None, 'current_party': None, 'expected': None}
+        ]
+
+        with mock.patch.object(models.db, 'execute_sql') as execute_sql:
+            data._upsert_race_meta(rows)
+
+        sql, params = execute_sql.call_args[0]
+        columns = '"{0}", "poll_closing", "first_results", "full_poll_closing", "current_party", "expected"'.format(key)
+
+        self.assertTrue(sql.startswith('INSERT INTO "racemeta" ({0}) VALUES (%s, %s, %s, %s, %s, %s), (%s, %s, %s, %s, %s, %s) '.format(columns)))
+        self.assertIn('ON CONFLICT ("{0}") DO UPDATE SET "poll_closing" = EXCLUDED."poll_closing",'.format(key), sql)
+        self.assertIn('IS DISTINCT FROM (EXCLUDED."poll_closing", EXCLUDED."first_results", EXCLUDED."full_poll_closing", EXCLUDED."current_party", EXCLUDED."expected");', sql)
+        self.assertNotIn('"{0}" = EXCLUDED'.format(key), sql)
+        self.assertEqual(params, [
+            'a', '7:00 PM', '7:30 PM', '8:00 PM', 'GOP', 'competitive',
+            'b', None, None, None, None, None
+        ])
+
+    def _create_unique_index(self, indexes):
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = indexes
+
+        with mock.patch.object(models.db, 'execute_sql', return_value=cursor) as execute_sql:
+            data._create_race_meta_unique_index()
+
+        return [call[0][0] for call in execute_sql.call_args_list[1:]]
+
+    def test_unique_index_replaces_plain_index(self):
+        key = models.RaceMeta.result_id.db_column
+        name = 'racemeta_{0}'.format(key)
+
+        statements = self._create_unique_index([(name, False)])
+
+        self.assertEqual(statements, [
+            'DROP INDEX "{0}";'.format(name),
+            'CREATE UNIQUE INDEX "{0}" ON "racemeta" ("{1}");'.format(name, key)
+        ])
+
+    def test_unique_index_created_when_missing(self):
+        key = models.RaceMeta.result_id.db_column
+
+        statements = self._create_unique_index([])
+
+        self.assertEqual(statements, ['CREATE UNIQUE INDEX "racemeta_{0}" ON "racemeta" ("{0}");'.format(key)])
+
+    def test_unique_index_kept_when_present(self):
+        key = models.RaceMeta.result_id.db_column
+
+        statements = self._create_unique_index([('racemeta_{0}'.format(key), True)])
+
+        self.assertEqual(statements, [])
+
+class ResultsCopyTestCase(unittest.TestCase):
+    """
+    Test error handling while streaming elex output into COPY
+    """
+
+    def _copy_with_failing_database(self, commands):
+        def copy_expert(sql, stream):
+            stream.read()
+            raise psycopg2.DataError('bad row')
+
+        cursor = mock.Mock()
+        cursor.copy_expert.side_effect = copy_expert
+
+        db = mock.MagicMock()
+        db.get_cursor.return_value = cursor
+        db.atomic.return_value.__exit__.return_value = False
+
+        with mock.patch.object(models, 'db', db):
+            data._copy_results('fast', commands)
+
+    def test_failed_command_raises_elex_error(self):
+        commands = ["printf 'id\\n1\\n'", "printf 'garbage'; exit 3"]
+
+        with self.assertRaises(utils.ElexError) as context:
+            self._copy_with_failing_database(commands)
+
+        self.assertEqual(context.exception.cmd, commands[1])
+        self.assertEqual(context.exception.output, 'garbage')
+
+    def test_database_error_raises_load_error(self):
+        commands = ["printf 'id\\n1\\n'", "printf 'id\\n2\\n'"]
+
+        with self.assertRaises(utils.ResultsLoadError) as context:
+            self._copy_with_failing_database(commands)
+
+        self.assertEqual(str(context.exception), 'bad row')
+        self.assertEqual(context.exception.output, "printf 'id\\n1\\n':\nid\n1\n\nprintf 'id\\n2\\n':\nid\n2\n")
+
+    def test_output_head_is_limited(self):
+        with tempfile.TemporaryFile() as head:
+            lines = list(data._tee_head(io.StringIO('id\n1\n2\n'), head, limit=4))
+
+            head.seek(0)
+            self.assertEqual(head.read(), b'id\n1')
+
+        self.assertEqual(lines, ['id\n', '1\n', '2\n'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file